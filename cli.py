@@ -1,14 +1,12 @@
 import logging
 import os
-import shutil
 
 from tinkergui.preparers import SystemPreparer
-from tinkergui.utils import ConfigManager, init_logger
+from tinkergui.utils import ConfigManager, fast_copy, init_logger
 
 if __name__ == "__main__":
     temp_dir = os.path.join(os.getcwd(), "temp")
-    if not os.path.exists(temp_dir):
-        os.makedirs(temp_dir)
+    os.makedirs(temp_dir, exist_ok=True)
     init_logger(log_file=os.path.join(temp_dir, "log"))
     logger = logging.getLogger(__name__)
 
@@ -20,6 +18,6 @@ if __name__ == "__main__":
     sysprep = SystemPreparer(working_directory=temp_dir)
     sysprep.prepare()
     final_txyz = sysprep.txyz_file
-    shutil.copy(final_txyz, os.path.join(os.getcwd(), f"{config.output_prefix}_final.xyz"))
+    fast_copy(final_txyz, os.path.join(os.getcwd(), f"{config.output_prefix}_final.xyz"))
     sysprep.key_file.save_key_file(os.path.join(os.getcwd(), f"{config.output_prefix}_final.key"))
     logger.info(f"Final prepared files saved to {os.getcwd()} with prefix {config.output_prefix}_final .")
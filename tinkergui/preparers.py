@@ -1,15 +1,28 @@
 import logging
 import math
+import mmap
 import os
 import re
-import shutil
+from collections import Counter
 
-from .utils import ConfigManager, TinkerKeyFile, AtomTypeFinder, make_readable_ids
+from .utils import ConfigManager, TinkerKeyFile, AtomTypeFinder, fast_copy, make_readable_ids
 from .tinker_runner import TinkerRunner
 
 
 logger = logging.getLogger(__name__)
-config = ConfigManager().get_config()
+_RE_MENU_OPTION = re.compile(r"\((\d+)\) ([^\n]+)")
+_RE_CHARGE = re.compile(r"Total Electric Charge :\s+([-+]?\d*\.\d+|\d+)\s+Electrons")
+
+
+def _get_config():
+    """Return the shared configuration, looked up on use so that importing this module stays cheap."""
+    return ConfigManager().get_config()
+
+
+def _xyzedit_options(menu):
+    """Map xyzedit menu descriptions to option numbers, parsed in one pass over the menu."""
+    return {desc.strip(): num for num, desc in _RE_MENU_OPTION.findall(menu)}
+
 
 class BasePreparer:
     """Base class for all kinds of molecular system preparers."""
@@ -25,11 +38,12 @@ class BasePreparer:
         if os.path.exists(raw_structure_file):
             # check and copy raw structure file to working directory
             if not os.path.exists(os.path.join(self.wd, os.path.basename(self.raw_structure_file))):
-                shutil.copy(self.raw_structure_file, self.wd)
+                fast_copy(self.raw_structure_file, self.wd)
             self.raw_structure_file = os.path.join(self.wd, os.path.basename(self.raw_structure_file))
 
     def pdb_to_txyz(self):
         """Convert PDB file to Tinker XYZ format."""
+        config = _get_config()
         assert os.path.splitext(self.raw_structure_file)[1].lower() == '.pdb', "Input file must be a PDB file."
         tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
         tinker.call(
@@ -44,59 +58,89 @@ class BasePreparer:
 
     def align_to_inertial_frame(self):
         """Align the molecular system to its inertial frame."""
+        config = _get_config()
         assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
         tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
-        outs = tinker.call(
+        with tinker.interactive(
             program='xyzedit',
             cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps='\n\n',
-            envs='',
-            pre_cmds='',
-        )
-        option_num = re.findall(r"\((\d+)\) Translate and Rotate to Inertial Frame", outs)[0]
-        outs = tinker.call(
-            program='xyzedit',
-            cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps=f'{option_num}\n\n',
             envs='',
             pre_cmds='',
             expected_outfiles=(self.txyz_file + "_2",),
-            custom_outfile_suffix='_aligned',
-        )
-        logger.info(f"Aligned Tinker XYZ {self.txyz_file} to its inertial frame.")
-        return os.path.join(self.wd, os.path.splitext(self.txyz_file)[0] + "_aligned.xyz")
+        ) as xyzedit:
+            option_num = _xyzedit_options(xyzedit.outs)["Translate and Rotate to Inertial Frame"]
+            xyzedit.send(option_num)
+            xyzedit.send('')
+        new_txyz = self._commit_stage(self.txyz_file + "_2", self.txyz_file)
+        logger.info(f"Aligned Tinker XYZ {new_txyz} to its inertial frame.")
+        return new_txyz
+
+    def _commit_stage(self, new_txyz, prev_txyz):
+        """Atomically replace the previous stage's Tinker XYZ with the new one, so only the latest stays on disk.
+
+        Returns:
+            str: path of the committed Tinker XYZ file, i.e. the path of `prev_txyz` in the working directory
+        """
+        prev_txyz = os.path.join(self.wd, os.path.basename(prev_txyz))
+        os.replace(os.path.join(self.wd, os.path.basename(new_txyz)), prev_txyz)
+        return prev_txyz
 
     def get_net_charge(self) -> float:
         """Calculate and return the net charge of the molecular system."""
+        config = _get_config()
         assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
         tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
-        outs = tinker.call(
+        outs = tinker.run_streaming(
             program='analyze',
             cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
             inter_inps='M\n',
             envs='',
             pre_cmds='',
+            match_patterns=(_RE_CHARGE,),
         )
-        charge = re.findall(r"Total Electric Charge :\s+([-+]?\d*\.\d+|\d+)\s+Electrons", outs)[0]
+        charge = outs[_RE_CHARGE.pattern]
         charge = int(float(charge))
         return charge
 
+    def _iter_atom_lines(self, maxsplit=-1):
+        """Stream the atom lines of the Tinker XYZ file, yielding each one split into (at most `maxsplit` + 1) fields.
+        The file is memory-mapped and fields are left as ASCII bytes, since `int()`/`float()` take bytes directly
+        and decoding every line would only cost time."""
+        with open(self.txyz_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mm.readline()  # skip the first line (number of atoms)
+            parts = mm.readline().split(None, maxsplit)
+            if parts and b"." not in parts[1]:
+                yield parts  # no box info, so the second line is already an atom
+            for line in iter(mm.readline, b''):
+                parts = line.split(None, maxsplit)
+                if parts:
+                    yield parts
+
     def get_bounding_box_size(self, buffer: float = 12.0):
         """Calculate and return the minimum bounding box dimensions with optional padding buffer."""
         assert os.path.exists(self.txyz_file), f"This operation cannot be done without a Tinker XYZ file. {self.txyz_file} not found."
-        with open(self.txyz_file) as f:
-            lines = f.readlines()
-        if "." in lines[1].strip().split()[1]:
-            lines = lines[2:]  # skip the second line if it contains a float (box info)
-        else:
-            lines = lines[1:]  # skip the first line (number of atoms)
-
-        xs = [float(line.strip().split()[2]) for line in lines if line.strip()]
-        ys = [float(line.strip().split()[3]) for line in lines if line.strip()]
-        zs = [float(line.strip().split()[4]) for line in lines if line.strip()]
-        x_size = math.ceil(max(xs) - min(xs) + 2 * buffer)
-        y_size = math.ceil(max(ys) - min(ys) + 2 * buffer)
-        z_size = math.ceil(max(zs) - min(zs) + 2 * buffer)
+        # one streaming pass with running extrema, instead of holding all lines and coordinates in memory
+        xmin = ymin = zmin = math.inf
+        xmax = ymax = zmax = -math.inf
+        # only the coordinates are needed, so the atom type and bonded atoms are left unsplit
+        for parts in self._iter_atom_lines(maxsplit=5):
+            x, y, z = float(parts[2]), float(parts[3]), float(parts[4])
+            # plain comparisons, as min()/max() calls cost several times more per atom
+            if x < xmin:
+                xmin = x
+            if x > xmax:
+                xmax = x
+            if y < ymin:
+                ymin = y
+            if y > ymax:
+                ymax = y
+            if z < zmin:
+                zmin = z
+            if z > zmax:
+                zmax = z
+        x_size = math.ceil(xmax - xmin + 2 * buffer)
+        y_size = math.ceil(ymax - ymin + 2 * buffer)
+        z_size = math.ceil(zmax - zmin + 2 * buffer)
         logger.info(f"Calculated bounding box size: ({x_size}, {y_size}, {z_size}) Å with buffer {buffer} Å.")
         return (x_size, y_size, z_size)
 
@@ -139,6 +183,7 @@ class LigandPreparer(BasePreparer):
 class SolventBoxPreparer(BasePreparer):
     """Preparer for solvent boxes."""
     def __init__(self, working_directory, solvent_name, box_type, box_size, key_file) -> None:
+        config = _get_config()
         self.solvent_name = solvent_name
         self.box_type = box_type
         self.box_size = box_size
@@ -151,39 +196,35 @@ class SolventBoxPreparer(BasePreparer):
 
     def prepare(self):
         """Prepare the solvent box: generate solvent molecules, pack the box, etc."""
+        config = _get_config()
         if self.solvent_name.lower() == "water":
             assert max(self.box_size) <= 120, "Predefined water box is only as big as 120 Å."
             assert self.box_type.lower() == "cuboid", "Predefined water box is only cubic."
             water_O_type = self.atom_type_finder.find_atom_type(description="Water O")
             water_H_type = self.atom_type_finder.find_atom_type(description="Water H")
             tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
-            outs = tinker.call(
+            with tinker.interactive(
                 program='xyzedit',
                 cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-                inter_inps='\n\n',
-                envs='',
-                pre_cmds='',
-            )
-            option_nums = [
-                re.findall(r"\((\d+)\) Replace Old Atom Type with a New Type", outs)[0],
-                re.findall(r"\((\d+)\) Translate and Rotate to Inertial Frame", outs)[0],
-                re.findall(r"\((\d+)\) Trim a Periodic Box to a Smaller Size", outs)[0],
-            ]
-            outs = tinker.call(
-                program='xyzedit',
-                cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-                inter_inps=(
-                    f"{option_nums[0]}\n1,{water_O_type}\n"
-                    f"{option_nums[0]}\n2,{water_H_type}\n"
-                    f"{option_nums[1]}\n"
-                    f"{option_nums[2]}\n{self.box_size[0]},{self.box_size[1]},{self.box_size[2]}\n"
-                    "\n"
-                ),
                 envs='',
                 pre_cmds='',
                 expected_outfiles=(self.txyz_file + "_2",),
                 custom_outfile_suffix='_trimmed',
-            )
+            ) as xyzedit:
+                options = _xyzedit_options(xyzedit.outs)
+                option_nums = [
+                    options["Replace Old Atom Type with a New Type"],
+                    options["Translate and Rotate to Inertial Frame"],
+                    options["Trim a Periodic Box to a Smaller Size"],
+                ]
+                for answer in (
+                    option_nums[0], f"1,{water_O_type}",
+                    option_nums[0], f"2,{water_H_type}",
+                    option_nums[1],
+                    option_nums[2], f"{self.box_size[0]},{self.box_size[1]},{self.box_size[2]}",
+                    '',
+                ):
+                    xyzedit.send(answer)
             new_txyz = os.path.join(self.wd, os.path.splitext(self.txyz_file)[0] + "_trimmed.xyz")
             logger.info(f"Prepared water solvent box Tinker XYZ: {new_txyz} .")
             return new_txyz, (water_O_type, water_H_type)
@@ -194,6 +235,7 @@ class SolventBoxPreparer(BasePreparer):
 class SystemPreparer(BasePreparer):
     """Preparer for the entire molecular system with everything included."""
     def __init__(self, working_directory=".") -> None:
+        config = _get_config()
         structure_file = os.path.join(working_directory, f"{config.output_prefix}.xyz")
         key_file = os.path.join(working_directory, f"{config.output_prefix}.key")
         super().__init__(working_directory, raw_structure_file=structure_file, key_file=key_file)
@@ -212,21 +254,31 @@ class SystemPreparer(BasePreparer):
                         'ligand': LigandPreparer
                     }[k](working_directory=self.wd, raw_structure_file=vi, key_file=self.key_file)
                 )
+        # every stage rewrites the system file in place, so it must not be a component's own Tinker XYZ
+        for component in self.components:
+            if os.path.basename(component.txyz_file) == os.path.basename(self.txyz_file):
+                raise ValueError(
+                    f"output_prefix '{config.output_prefix}' clashes with solute file {component.raw_structure_file}; "
+                    "please choose a different output_prefix."
+                )
         self.solvent_atom_types = []
         self.atom_type_finder = AtomTypeFinder(prm_file_path=config.amoeba_prm)
         self.box_size = None
 
     def prepare(self):
         """Prepare the entire molecular system."""
+        config = _get_config()
+        # fail before any component is prepared, rather than after all of them
+        if len(self.components) > 1:
+            raise NotImplementedError("Combining multiple components is not yet implemented.")
         for component in self.components:
             component.prepare()
 
         # combine all components into one system
-        if len(self.components) > 1:
-            raise NotImplementedError("Combining multiple components is not yet implemented.")
-        else:
-            shutil.copy(os.path.join(self.wd, os.path.basename(self.components[0].txyz_file)), 
-                        os.path.join(self.wd, os.path.basename(self.txyz_file)))
+        fast_copy(
+            os.path.join(self.wd, os.path.basename(self.components[0].txyz_file)),
+            os.path.join(self.wd, os.path.basename(self.txyz_file)),
+        )
         logger.info(f"Combined solutes and then obtained the system Tinker XYZ: {self.txyz_file}.")
 
         # align to inertial frame
@@ -249,119 +301,137 @@ class SystemPreparer(BasePreparer):
         self.key_file.set_key("c-axis", str(self.box_size[2]))
         if config.box.type.lower() != "cuboid":
             raise NotImplementedError(f"Box type {config.box.type} not yet implemented for box info in key. Currently only `cuboid` is supported.")
-        # add ions
-        self.txyz_file = self.neutralize()
-        self.txyz_file = self.add_salts()
+        # add counter ions and salts together in one pass
+        ions = self.neutralize() + self.add_salts()
+        if ions:
+            self.txyz_file = self.add_ions(ions)
+            logger.info(f"Added ions to the system: {self.txyz_file} .")
+
+    def get_net_charge(self) -> int:
+        """Calculate the net charge by summing per-atom-type charges from the parameter file.
+        Falls back to Tinker `analyze` if the key file has its own multipole records (which override the
+        parameter file), or if any atom type has no single charge in the parameter file."""
+        assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
+        if any(key[0].lower() == 'multipole' for key in self.key_file.keys):
+            logger.info(f"Key file {self.key_file.latest_path} has multipole records. Using Tinker analyze instead.")
+            return super().get_net_charge()
+        type_counts = Counter(parts[5] for parts in self._iter_atom_lines(maxsplit=6))
+        charge = 0.0
+        for atom_type, count in type_counts.items():
+            atom_type = atom_type.decode()
+            atom_charge = self.atom_type_finder.find_atom_charge(atom_type=atom_type)
+            if atom_charge is None:
+                logger.info(f"No unique charge found for atom type {atom_type} in {self.atom_type_finder.prm_file_path}. Using Tinker analyze instead.")
+                return super().get_net_charge()
+            charge += atom_charge * count
+        return round(charge)
 
     def soak_into_box(self, boxfile):
         """Soak the system into a solvent box."""
+        config = _get_config()
         assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
         tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
-        outs = tinker.call(
-            program='xyzedit',
-            cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps='\n\n',
-            envs='',
-            pre_cmds='',
-        )
-        option_num = re.findall(r"\((\d+)\) Soak Current Molecule in Box of Solvent", outs)[0]
-        outs = tinker.call(
+        with tinker.interactive(
             program='xyzedit',
             cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps=f'{option_num}\n{os.path.basename(boxfile)}\n\n',
             envs='',
             pre_cmds='',
             expected_outfiles=(self.txyz_file + "_2",),
-            custom_outfile_suffix='_solvated',
-        )
-        new_txyz = os.path.join(self.wd, os.path.splitext(self.txyz_file)[0] + "_solvated.xyz")
+        ) as xyzedit:
+            option_num = _xyzedit_options(xyzedit.outs)["Soak Current Molecule in Box of Solvent"]
+            xyzedit.send(option_num)
+            xyzedit.send(os.path.basename(boxfile))
+            xyzedit.send('')
+        new_txyz = self._commit_stage(self.txyz_file + "_2", self.txyz_file)
         logger.info(f"Soaked the system into solvent box: {new_txyz} .")
         return new_txyz
     
-    def add_ions(self, atom_type, number, suffix):
-        """Add ions of specified types and number to the system."""
-        solute_atom_indices = self.get_solute_atom_indices()
-        solute_atom_indices_string = ""
-        for i in solute_atom_indices:
-            if len(i) == 2:
-                solute_atom_indices_string += f"-{i[0]},{i[1]},"
-            else:
-                solute_atom_indices_string += f"{i[0]},"
-        solute_atom_indices_string = solute_atom_indices_string.rstrip(',')
+    def add_ions(self, ions):
+        """Add ions to the system in one xyzedit session.
+
+        Args:
+            ions (list): (atom type, number) pairs of all ion species to add
+
+        Returns:
+            str: path of the new Tinker XYZ file
+        """
+        config = _get_config()
         tinker = TinkerRunner(wd=self.wd, tinker_path=config.tinker_path)
-        outs = tinker.call(
+        with tinker.interactive(
             program='xyzedit',
             cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps='\n\n',
-            envs='',
-            pre_cmds='',
-        )
-        option_num = re.findall(r"\((\d+)\) Place Monoatomic Ions around a Solute", outs)[0]
-        outs = tinker.call(
-            program='xyzedit',
-            cmd_args=f"{os.path.basename(self.txyz_file)} -k {self.key_file.latest_path}",
-            inter_inps=(
-                f'{option_num}\n'
-                f'{solute_atom_indices_string}\n'
-                f'{atom_type},{number}\n\n'
-            ),
             envs='',
             pre_cmds='',
             expected_outfiles=(self.txyz_file + "_2",),
-            custom_outfile_suffix=suffix,
-        )
+        ) as xyzedit:
+            option_num = _xyzedit_options(xyzedit.outs)["Place Monoatomic Ions around a Solute"]
+            xyzedit.send(option_num)
+            xyzedit.send(self.get_solute_atom_indices_string())
+            # xyzedit keeps asking for ion species until an empty answer
+            for atom_type, number in ions:
+                xyzedit.send(f'{atom_type},{number}')
+            xyzedit.send('')
+        return self._commit_stage(self.txyz_file + "_2", self.txyz_file)
     
     def neutralize(self):
-        """Neutralize the system by adding counter ions."""
+        """Find the counter ions needed to neutralize the system.
+
+        Returns:
+            list: (atom type, number) pairs of counter ions, empty if the system is already neutral
+        """
+        config = _get_config()
         assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
         charge = self.get_net_charge()
         # charge = 4   # just for testing
         if charge == 0:
             logger.info("The system is already neutral. No need to add counter ions.")
-            return self.txyz_file
+            return []
         for ion in config.ions.neutralizers:
             ion_atom_type = self.atom_type_finder.find_atom_type(description=f"Ion {ion.strip('+-123').capitalize()}")
             ion_charge = self.atom_type_finder.find_atom_charge(atom_type=ion_atom_type)
             if ion_charge * charge < 0:
                 counter_ion = ion_atom_type
                 num_to_add = int(abs(charge / ion_charge))
+                counter_ion_name = ion
 
-        self.add_ions(counter_ion, num_to_add, suffix='_neutralized')
-        new_txyz = os.path.join(self.wd, os.path.splitext(self.txyz_file)[0] + "_neutralized.xyz")
-        logger.info(f"Neutralized the system: {new_txyz} .")
-        return new_txyz
+        logger.info(f"Will add {num_to_add} of ion {counter_ion_name} to neutralize net charge {charge}.")
+        return [(counter_ion, num_to_add)]
 
     def add_salts(self):
-        """Add ions to neutralize the system and set salt concentration."""
-        assert os.path.exists(self.txyz_file), "This operation cannot be done without a Tinker XYZ file."
+        """Find the ions needed to set the salt concentrations.
+
+        Returns:
+            list: (atom type, number) pairs of salt ions
+        """
+        config = _get_config()
         if config.box.type.lower() == "cuboid":
             box_volume = self.box_size[0] * self.box_size[1] * self.box_size[2]
         else:
             raise NotImplementedError(f"Box type {config.box.type} not yet implemented for salt addition.")
         box_volume_liters = box_volume * 1e-27  # convert from Å^3 to liters
+        salts = []
         for ion, conc in zip(config.ions.salts.names, config.ions.salts.concentrations):
             ion_atom_type = self.atom_type_finder.find_atom_type(description=f"Ion {ion.strip('+-123').capitalize()}")
             num_ions = int(conc * box_volume_liters * 6.022e23)  # mol/L * L * Avogadro's number
             if num_ions > 0:
-                self.add_ions(ion_atom_type, num_ions, suffix=f'_{ion}_added')
-                new_txyz = os.path.join(self.wd, os.path.splitext(self.txyz_file)[0] + f"_{ion}_added.xyz")
-                logger.info(f"Added {num_ions} of ion {ion} to the system: {new_txyz} .")
-                self.txyz_file = new_txyz
-        return self.txyz_file
+                logger.info(f"Will add {num_ions} of ion {ion} for salt concentration {conc} mol/L.")
+                salts.append((ion_atom_type, num_ions))
+        return salts
+
+    def get_solute_atom_indices_string(self):
+        """Return the solute atoms as xyzedit input, e.g. `-1,20,25` for atoms 1 to 20 and 25."""
+        ranges = []
+        for i in self.get_solute_atom_indices():
+            if isinstance(i, list):
+                ranges.append(f"-{i[0]},{i[1]}")
+            else:
+                ranges.append(f"{i}")
+        return ",".join(ranges)
 
     def get_solute_atom_indices(self):
-        with open(self.txyz_file) as f:
-            lines = f.readlines()
-        if "." in lines[1].strip().split()[1]:
-            lines = lines[2:]  # skip the second line if it contains a float (box info)
-        else:
-            lines = lines[1:]  # skip the first line (number of atoms)
-        lines = [line.strip().split() for line in lines]
-        solute_atom_indices = [int(line[0]) for line in lines if line[5] not in self.solvent_atom_types]
+        """Return the indices of all non-solvent atoms as readable ranges (see `make_readable_ids`)."""
+        solvent_atom_types = frozenset(str(t).encode() for t in self.solvent_atom_types)
+        # atom type is the 6th field, so the trailing bonded atoms never need to be split
+        solute_atom_indices = [int(parts[0]) for parts in self._iter_atom_lines(maxsplit=6) if parts[5] not in solvent_atom_types]
         solute_atom_indices = make_readable_ids(solute_atom_indices)
         return solute_atom_indices
-    
-
-
-
-
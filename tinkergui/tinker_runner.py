@@ -1,10 +1,53 @@
+import contextlib
 import os
 import logging
+import re
+import select
+import signal
 import subprocess
 import sys
+import threading
 
 logger = logging.getLogger(__name__)
 
+
+class TinkerSession:
+    """A live interactive Tinker program whose output is read up to its first menu prompt.
+    Answers that depend on the menu (e.g. option numbers) can thus be composed from `outs` before any is sent;
+    they are collected by `send` and fed all at once when the session ends.
+    """
+    PROMPT = re.compile(r"(?:Enter|Choice)[^\n]*:[ \t]*\Z")
+
+    def __init__(self, proc, timeout=300):
+        self.proc = proc
+        self.timeout = timeout
+        self.inputs = ''
+        self.timed_out = False
+        self.outs = self.read_until_prompt()
+
+    def read_until_prompt(self):
+        """Read stdout until the program asks for its first choice, exits, or times out."""
+        fd = self.proc.stdout.fileno()
+        chunks = []
+        tail = ''
+        while True:
+            ready, _, _ = select.select([fd], [], [], self.timeout)
+            if not ready:
+                self.timed_out = True
+                break
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break  # program exited
+            chunks.append(chunk)
+            tail = (tail + chunk.decode(errors='replace'))[-256:]
+            if self.PROMPT.search(tail):
+                break
+        return b''.join(chunks).decode(errors='replace')
+
+    def send(self, answer=''):
+        """Queue the answer to the next prompt."""
+        self.inputs += answer + '\n'
+
 class TinkerRunner:
     """Python wrapper to call tinker cmdline program
     """
@@ -30,21 +73,13 @@ class TinkerRunner:
             this list is used to verify that the expected files were successfully created.
         custom_outfile_suffix: this suffix is used to name the output files. if not provided, use tinker's default.
         """
-        # check tinker executable exists
-        if not os.path.isfile(os.path.join(self.tinker_path, program)):
-            program += ".x"
-            if not os.path.isfile(os.path.join(self.tinker_path, program)):
-                logger.error(f"Tinker executable {program[:-2]} or {program} not found in path {self.tinker_path}.")
-                logger.error("Termination due to failed Tinker call.")
-                sys.exit(1)
-        
-        pre_cmds = "&& " + pre_cmds if pre_cmds else ''
-        cmd = f"cd {self.wd} {pre_cmds} && {envs} {self.tinker_path}/{program} {cmd_args}"
+        cmd = self._build_cmd(program, cmd_args, envs, pre_cmds)
         proc = None
         try:
             proc = subprocess.Popen(
                 cmd,
                 shell=True,
+                start_new_session=True,  # own process group, so a kill also reaches the program behind the shell
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
@@ -54,8 +89,145 @@ class TinkerRunner:
             outs, errs = "", str(e)
         finally:
             if proc:
-                proc.kill()  # this is important to cleanup properly, e.g., release memory.
+                self._kill(proc)  # this is important to cleanup properly, e.g., release memory.
+
+        self._check_results(cmd, inter_inps, outs, errs, expected_outfiles, custom_outfile_suffix)
+        return outs
 
+    def run_streaming(self, program, cmd_args='', inter_inps='', envs='', pre_cmds='', match_patterns=()):
+        """Call a Tinker program and scan its output line by line for `match_patterns` instead of buffering it all.
+        The program is stopped as soon as every pattern has matched, e.g. to pick one value out of a long `analyze` output.
+
+        example args:
+        program='analyze'
+        cmd_args='xxx.xyz -k xxxx.key'
+        inter_inps='M\\n'
+        match_patterns=(re.compile(r"Total Electric Charge :\\s+(\\S+)\\s+Electrons"),)
+
+        Returns:
+            dict: first captured group (whole match if none) of each pattern, keyed by the pattern string;
+                the call fails like any other if a pattern never matched
+        """
+        cmd = self._build_cmd(program, cmd_args, envs, pre_cmds)
+        matches = {}
+        errs = ''
+        pending = list(match_patterns)
+        proc = subprocess.Popen(
+            cmd,
+            shell=True,
+            start_new_session=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
+            text=True,
+        )
+        timed_out = threading.Event()
+        def _on_timeout():
+            timed_out.set()
+            self._kill(proc)
+        timer = threading.Timer(self.timeout, _on_timeout)
+        timer.start()
+        try:
+            try:
+                proc.stdin.write(inter_inps)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            for line in proc.stdout:
+                for pattern in tuple(pending):
+                    m = pattern.search(line)
+                    if m:
+                        matches[pattern.pattern] = m.group(1) if pattern.groups else m.group(0)
+                        pending.remove(pattern)
+                if not pending:
+                    break  # everything found, no need to wait for the rest
+            else:
+                errs = proc.stderr.read()
+        except Exception as e:
+            errs = str(e)
+        finally:
+            timer.cancel()
+            self._kill(proc)  # this is important to cleanup properly, e.g., release memory.
+            proc.wait()
+
+        if timed_out.is_set():
+            errs = f"Timed out after {self.timeout} s."
+        elif pending and not errs:
+            errs = "Expected output not found: " + ", ".join(f"'{p.pattern}'" for p in pending)
+        self._check_results(cmd, inter_inps, '', errs, (), '')
+        logger.info(f"Matched Output: {matches}")
+        return matches
+
+    @contextlib.contextmanager
+    def interactive(self, program, cmd_args='', envs='', pre_cmds='', expected_outfiles=(), custom_outfile_suffix=''):
+        """Run a Tinker program as one session, e.g. to chain several xyzedit menu operations.
+        Yields a `TinkerSession` whose `outs` already holds everything printed up to the first menu prompt;
+        the answers queued with `send` are fed once the `with` block ends. Output files are verified (and renamed) after the session ends, same as in `call`.
+
+        example:
+        with tinker.interactive('xyzedit', 'xxx.xyz -k xxx.key', expected_outfiles=('xxx.xyz_2',)) as xyzedit:
+            option_num = re.findall(r"\\((\\d+)\\) Translate and Rotate to Inertial Frame", xyzedit.outs)[0]
+            xyzedit.send(option_num)
+            xyzedit.send('')
+        """
+        cmd = self._build_cmd(program, cmd_args, envs, pre_cmds)
+        # gfortran block-buffers stdout on pipes, which would hide the menu prompt we wait for
+        env = dict(os.environ, GFORTRAN_UNBUFFERED_PRECONNECTED='y')
+        proc = subprocess.Popen(
+            cmd,
+            shell=True,
+            start_new_session=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            env=env,
+        )
+        try:
+            session = TinkerSession(proc, timeout=self.timeout)
+            if session.timed_out:
+                self._kill(proc)
+                proc.wait()
+                errs = f"Timed out after {self.timeout} s waiting for Tinker prompt."
+                self._check_results(cmd, session.inputs, session.outs, errs, expected_outfiles, custom_outfile_suffix)
+            yield session
+            # only the menu had to be read beforehand, so all answers can go in at once
+            try:
+                outs, errs = map(lambda x: x.decode(), proc.communicate(input=session.inputs.encode(), timeout=self.timeout))
+            except Exception as e:
+                outs, errs = "", str(e)
+            session.outs += outs
+        finally:
+            self._kill(proc)  # this is important to cleanup properly, e.g., release memory.
+            proc.wait()
+        self._check_results(cmd, session.inputs, session.outs, errs, expected_outfiles, custom_outfile_suffix)
+
+    @staticmethod
+    def _kill(proc):
+        """Kill the shell and the Tinker program it started, i.e. the whole process group of `proc`."""
+        if proc.returncode is not None:
+            return  # already reaped, its group id may be taken by now
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # already gone
+
+    def _build_cmd(self, program, cmd_args, envs, pre_cmds):
+        """Locate the Tinker executable and compose the shell command to run it."""
+        # check tinker executable exists
+        if not os.path.isfile(os.path.join(self.tinker_path, program)):
+            program += ".x"
+            if not os.path.isfile(os.path.join(self.tinker_path, program)):
+                logger.error(f"Tinker executable {program[:-2]} or {program} not found in path {self.tinker_path}.")
+                logger.error("Termination due to failed Tinker call.")
+                sys.exit(1)
+
+        pre_cmds = "&& " + pre_cmds if pre_cmds else ''
+        return f"cd {self.wd} {pre_cmds} && {envs} {self.tinker_path}/{program} {cmd_args}"
+
+    def _check_results(self, cmd, inter_inps, outs, errs, expected_outfiles, custom_outfile_suffix):
+        """Log a finished Tinker call, exit on errors, and verify/rename its output files."""
         logger.info(f"Called Tinker: {cmd} ; Interactive Inputs Used: '" + inter_inps.replace('\n', '\\n') + "'")
         if outs:
             logger.info(f"Output: \n{outs}")
@@ -75,7 +247,6 @@ class TinkerRunner:
                 base, ext = os.path.splitext(os.path.basename(fname))
                 new_name = f"{base}{custom_outfile_suffix}{ext.rsplit('_', 1)[0]}"
                 os.rename(os.path.join(self.wd, os.path.basename(fname)), os.path.join(self.wd, new_name))
-        return outs
 
     # not used currently
     # def call_protein_shortcut(self, seq, file_name, param_file="/path/to/amoebabio18.prm", clear_wd=False):
@@ -1,16 +1,62 @@
 import argparse
 import collections.abc
+import copy
 import json
 import yaml
 import sys
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional, Sequence
 import os
 import logging
+import re
+import shutil
 import subprocess
 from collections import OrderedDict
 
+try:
+    # libyaml-backed C implementations, much faster than the pure-Python ones
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+class _Dumper(SafeDumper):
+    """Private dumper, so that the representer below does not leak into PyYAML's own dumpers."""
+
+
+# dump OrderedDict as a plain mapping, keeping its order
+_Dumper.add_representer(OrderedDict, lambda dumper, data: dumper.represent_dict(data.items()))
+
 logger = logging.getLogger(__name__)
 
+# parsed files, keyed by `_file_cache_key` so that edited files are re-read
+_YAML_CACHE = OrderedDict()
+_YAML_CACHE_SIZE = 100
+_PRM_CACHE = {}
+
+
+def _file_cache_key(path):
+    """Identify the current version of a file by its absolute path, modification time and size."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def _cached_yaml_load(path):
+    """Load a YAML file, reusing the parsed data as long as the file is unchanged.
+
+    Returns:
+        a deep copy of the parsed data (empty dict for an empty file), free for the caller to modify
+    """
+    key = _file_cache_key(path)
+    if key in _YAML_CACHE:
+        _YAML_CACHE.move_to_end(key)
+    else:
+        with open(path, 'rb') as f:
+            _YAML_CACHE[key] = yaml.load(f, Loader=SafeLoader) or {}
+        while len(_YAML_CACHE) > _YAML_CACHE_SIZE:
+            _YAML_CACHE.popitem(last=False)
+    return copy.deepcopy(_YAML_CACHE[key])
+
+
 def init_logger(log_file=None, level=logging.INFO):
     root_logger = logging.getLogger()
     for h in root_logger.handlers:
@@ -27,8 +73,11 @@ def init_logger(log_file=None, level=logging.INFO):
         root_logger.addHandler(fhlr)
 
 
+_Mapping = collections.abc.Mapping
+
+
 def recursive_update(d, u):
-    """recursivly update a dictionary
+    """recursivly update a dictionary, walking nested levels with an explicit stack instead of recursion
     https://stackoverflow.com/questions/3232943/update-value-of-a-nested-dictionary-of-varying-depth
 
     Args:
@@ -38,14 +87,29 @@ def recursive_update(d, u):
     Returns:
         dict: updated dictionary
     """
-    for k, v in u.items():
-        if isinstance(v, collections.abc.Mapping):
-            d[k] = recursive_update(d.get(k, {}), v)
-        else:
-            d[k] = v
+    stack = [(d, u)]
+    while stack:
+        dst, src = stack.pop()
+        for k, v in src.items():
+            if isinstance(v, _Mapping):
+                sub = dst.get(k)
+                if not isinstance(sub, dict):
+                    sub = dst[k] = {}
+                stack.append((sub, v))
+            else:
+                dst[k] = v
     return d
 
 
+def _build_help(param):
+    """Build the CLI help string of a config parameter, suffixed with its default."""
+    if param['type'] == list:
+        return param['help'] + f" (Default: {' '.join(map(str, param['default']))})"
+    elif param['type'] == dict:
+        return param['help'] + f" (Default: '{json.dumps(param['default'])}')"
+    return param['help'] + f" (Default: {param['default']})"
+
+
 class ConfigManager:
     """Singleton General Config Manager for Tinker GUI/CLI applications.
     `CONFIG_DEFINITION` serves as the single source of truth for all configuration parameters.
@@ -75,6 +139,8 @@ class ConfigManager:
 
     _instance = None
     _initialized = False
+    _parser = None  # built on the first parse_args call, then shared
+    _HELP_CACHE = {p['name']: _build_help(p) for p in CONFIG_DEFINITION}  # formatted once at import
     
     def __new__(cls):
         if cls._instance is None:
@@ -86,18 +152,22 @@ class ConfigManager:
         if ConfigManager._initialized:
             return
         self.config = argparse.Namespace()
-        self.parser = argparse.ArgumentParser(description="Tinker-GUI CLI Config Manager")
-        self._add_arguments()
+        # fixed per-parameter metadata, derived once: (name, path, dest, default, type, is_solute)
+        self._defs = tuple(
+            (p['name'], tuple(p['name'].split('.')), p['name'].replace('.', '__'), p['default'], p['type'], p['name'].startswith('solutes.'))
+            for p in ConfigManager.CONFIG_DEFINITION
+        )
+        self.parser = None
         ConfigManager._initialized = True
 
-    def _add_arguments(self):
+    def _add_arguments(self, parser: argparse.ArgumentParser):
         """Add command-line arguments based on CONFIG_DEFINITION."""
-        self.parser.add_argument(
+        parser.add_argument(
             '-c', '--config', 
             type=str, 
             help='Path to the YAML config file.'
         )
-        self.parser.add_argument(
+        parser.add_argument(
             '--generate-yaml-template', 
             action='store_true', 
             help='Generate a sample YAML config and exit.'
@@ -109,52 +179,65 @@ class ConfigManager:
             option = f"--{path_name.replace('.', '-')}"
             dest = path_name.replace('.', '__')
             if param['type'] == list:
-                self.parser.add_argument(
+                parser.add_argument(
                     option,
                     dest=dest,
                     type=type(param['default'][0]) if param['default'] else str,
                     nargs='+',
                     default=None, # Use None to detect if user provided it
-                    help=param['help'] + f" (Default: {' '.join(map(str, param['default']))})"
+                    help=ConfigManager._HELP_CACHE[path_name]
                 )
             elif param['type'] == dict:
-                self.parser.add_argument(
+                parser.add_argument(
                     option,
                     dest=dest,
                     type=json.loads,
                     default=None, # Use None to detect if user provided it
-                    help=param['help'] + f" (Default: '{json.dumps(param['default'])}')"
+                    help=ConfigManager._HELP_CACHE[path_name]
                 )
             else:
-                self.parser.add_argument(
+                parser.add_argument(
                     option,
                     dest=dest,
                     type=param['type'],
                     default=None, # Use None to detect if user provided it
-                    help=param['help'] + f" (Default: {param['default']})"
+                    help=ConfigManager._HELP_CACHE[path_name]
                 )
 
     def _check_arguments_validity(self):
         """Check validity of certain arguments after parsing."""
+        # one stat per unique path, however often it is listed
+        seen = {}
+        def _exists(p):
+            r = seen.get(p)
+            if r is None:
+                try:
+                    os.stat(p)
+                    r = True
+                except (OSError, ValueError):
+                    r = False
+                seen[p] = r
+            return r
+
         has_solute = False
-        for param in ConfigManager.CONFIG_DEFINITION:
+        for name, path, dest, default, _, is_solute in self._defs:
             # check tinker_path, amoeba_prm must be different from default and exist
-            if param['name'] in ['tinker_path', 'amoeba_prm']:
-                value = getattr(self.config, param['name'].replace('.', '__'))
-                if value == param['default']:
-                    logger.error(f"Configuration parameter '{param['name']}' must be set to a valid path, not the default value.")
+            if name in ['tinker_path', 'amoeba_prm']:
+                value = getattr(self.config, dest)
+                if value == default:
+                    logger.error(f"Configuration parameter '{name}' must be set to a valid path, not the default value.")
                     sys.exit(1)
-                if not os.path.exists(value):
-                    logger.error(f"Path specified for '{param['name']}' does not exist: {value}")
+                if not _exists(value):
+                    logger.error(f"Path specified for '{name}' does not exist: {value}")
                     sys.exit(1)
             # check at least one of protein/nucleic_acid/ligand must be provided, different from default, and exist
-            if param['name'].startswith('solutes.'):  
+            if is_solute:
                 try:                  
-                    value = getattr(self.config.solutes, param['name'].split('.')[1])
-                    if value and value != param['default']:
+                    value = getattr(self.config.solutes, path[1])
+                    if value and value != default:
                         for fpath in value:
-                            if not os.path.exists(fpath):
-                                logger.error(f"Solute file specified for '{param['name']}' does not exist: {fpath}")
+                            if not _exists(fpath):
+                                logger.error(f"Solute file specified for '{name}' does not exist: {fpath}")
                                 sys.exit(1)
                         has_solute = True
                 except AttributeError:
@@ -168,20 +251,20 @@ class ConfigManager:
         """Generate a sample YAML configuration file based on CONFIG_DEFINITION."""
         # Use OrderedDict to maintain the order of parameters
         template_dict: Dict[str, Any] = OrderedDict()
-        for param in ConfigManager.CONFIG_DEFINITION:
+        for _, path, _, default, _, _ in self._defs:
             # Support nested keys with dot-paths
-            self._set_by_path(template_dict, param['name'].split('.'), param['default'])
+            self._set_by_path(template_dict, path, default)
 
-        yaml_string = yaml.dump(dict(template_dict), sort_keys=False)
-        if os.path.exists("sample_config.yaml"):
+        try:
+            f = open("sample_config.yaml", "x")
+        except FileExistsError:
             logger.error("sample_config.yaml already exists. Please remove it before generating a new template.")
             return
-        else:
-            with open("sample_config.yaml", "w") as f:
-                f.write(yaml_string)
+        with f:
+            yaml.dump(template_dict, f, Dumper=_Dumper, sort_keys=False)
 
     # ---------- Helpers for hierarchical configuration ----------
-    def _set_by_path(self, d: Dict[str, Any], path: List[str], value: Any) -> None:
+    def _set_by_path(self, d: Dict[str, Any], path: Sequence[str], value: Any) -> None:
         cur = d
         for key in path[:-1]:
             if key not in cur or not isinstance(cur[key], (dict, OrderedDict)):
@@ -189,7 +272,7 @@ class ConfigManager:
             cur = cur[key]
         cur[path[-1]] = value
 
-    def _remove_by_path(self, d: Dict[str, Any], path: List[str]) -> None:
+    def _remove_by_path(self, d: Dict[str, Any], path: Sequence[str]) -> None:
         cur = d
         for key in path[:-1]:
             if key not in cur or not isinstance(cur[key], (dict, OrderedDict)):
@@ -205,8 +288,10 @@ class ConfigManager:
         if not isinstance(inc, (dict, OrderedDict)):
             return dict(base)
         result = dict()
-        all_keys = list(base.keys()) + list(inc.keys())
-        for k in sorted(set(all_keys), key=lambda x: all_keys.index(x)):
+        # ordered union of keys (base's order, then new keys from inc) in linear time
+        all_keys = dict.fromkeys(base)
+        all_keys.update(dict.fromkeys(inc))
+        for k in all_keys:
             bv = base.get(k)
             iv = inc.get(k)
             if isinstance(bv, (dict, OrderedDict)) and isinstance(iv, (dict, OrderedDict)):
@@ -218,29 +303,38 @@ class ConfigManager:
         return result
 
     def _to_namespace(self, data: Dict[str, Any]) -> argparse.Namespace:
-        """Convert nested dicts into nested Namespaces for attribute access."""
-        if not isinstance(data, (dict, OrderedDict)):
-            return argparse.Namespace()
-        result = OrderedDict()
-        for k, v in data.items():
-            if isinstance(v, (dict, OrderedDict)):
-                result[k] = self._to_namespace(v)
-            else:
-                result[k] = v
-        return argparse.Namespace(**result)
+        """Convert nested dicts into nested Namespaces for attribute access, walking levels with an explicit stack."""
+        root = argparse.Namespace()
+        stack = [(data, root)]
+        while stack:
+            node, dst = stack.pop()
+            if not isinstance(node, (dict, OrderedDict)):
+                continue
+            for k, v in node.items():
+                if isinstance(v, (dict, OrderedDict)):
+                    child = argparse.Namespace()
+                    setattr(dst, k, child)
+                    stack.append((v, child))
+                else:
+                    setattr(dst, k, v)
+        return root
 
     def _to_plain_dict(self, ns_or_dict: Any) -> Dict[str, Any]:
-        """Convert Namespace (possibly nested) to plain dict recursively."""
-        if isinstance(ns_or_dict, argparse.Namespace):
-            ns_or_dict = vars(ns_or_dict)
-        if not isinstance(ns_or_dict, (dict, OrderedDict)):
-            return {}
+        """Convert Namespace (possibly nested) to plain dict, walking levels with an explicit stack."""
         out = dict()
-        for k, v in ns_or_dict.items():
-            if isinstance(v, argparse.Namespace) or isinstance(v, (dict, OrderedDict)):
-                out[k] = self._to_plain_dict(v)
-            else:
-                out[k] = v
+        stack = [(ns_or_dict, out)]
+        while stack:
+            node, dst = stack.pop()
+            if isinstance(node, argparse.Namespace):
+                node = vars(node)
+            if not isinstance(node, (dict, OrderedDict)):
+                continue
+            for k, v in node.items():
+                if isinstance(v, (argparse.Namespace, dict, OrderedDict)):
+                    dst[k] = dict()
+                    stack.append((v, dst[k]))
+                else:
+                    dst[k] = v
         return out
     
     # ---------- Public Methods ----------
@@ -249,9 +343,14 @@ class ConfigManager:
         Priority: Command-line > YAML file > Defaults"""
         # Build defaults as possibly nested dict based on dotted names
         defaults = OrderedDict()
-        for param in ConfigManager.CONFIG_DEFINITION:
-            self._set_by_path(defaults, param['name'].split('.'), param['default'])
-
+        for _, path, _, default, _, _ in self._defs:
+            self._set_by_path(defaults, path, default)
+
+        if ConfigManager._parser is None:
+            parser = argparse.ArgumentParser(description="Tinker-GUI CLI Config Manager")
+            self._add_arguments(parser)
+            ConfigManager._parser = parser
+        self.parser = ConfigManager._parser
         cmd_args = self.parser.parse_args()
 
         # Check for special flags first
@@ -261,34 +360,31 @@ class ConfigManager:
 
         yaml_config = OrderedDict()
         if cmd_args.config:
-            with open(cmd_args.config, 'r') as f:
-                yaml_config = yaml.safe_load(f) or {}
+            yaml_config = _cached_yaml_load(cmd_args.config)
 
         # Start with defaults and deep-merge YAML config values
         final_config = self._deep_merge(defaults, yaml_config)
-        # Finally, override with command-line arguments if provided
-        for param in ConfigManager.CONFIG_DEFINITION:
-            path = param['name']
-            dest = path.replace('.', '__')
+        # Finally, override with command-line arguments if provided, in the same pass as the solutes cleanup below
+        # (parameter paths never overlap, so handling each parameter fully before the next is equivalent)
+        for _, path, dest, default, _, is_solute in self._defs:
             cmd_value = getattr(cmd_args, dest, None)
             if cmd_value is not None:
-                self._set_by_path(final_config, path.split('.'), cmd_value)
-        # Remove solutes entries that were not provided via CLI or YAML thus exactly the same as examplary defaults
-        for param in ConfigManager.CONFIG_DEFINITION:
-            if param['name'].startswith('solutes.'):
-                path = param['name']
-                default_value = param['default']
+                self._set_by_path(final_config, path, cmd_value)
+            # Remove solutes entries that were not provided via CLI or YAML thus exactly the same as examplary defaults
+            if is_solute:
                 final_value = final_config
-                for key in path.split('.'):
+                for key in path:
                     final_value = final_value.get(key, None)
                     if final_value is None:
                         break
-                if final_value == default_value:
-                    self._remove_by_path(final_config, path.split('.'))
+                if final_value == default:
+                    self._remove_by_path(final_config, path)
 
         recursive_update(self.config.__dict__, self._to_namespace(final_config).__dict__)
         self._check_arguments_validity()
-        logger.info(f"Final Configuration: \n{yaml.dump(final_config, sort_keys=False)}")
+        # serializing the whole config only pays off if the message is actually emitted
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Final Configuration: \n%s", json.dumps(final_config, indent=2, ensure_ascii=False, default=str))
         
     def get_config(self) -> argparse.Namespace:
         """Return the current configuration as an argparse.Namespace object."""
@@ -297,12 +393,14 @@ class ConfigManager:
     def save_yaml(self, path: str):
         data = self._to_plain_dict(self.config)
         with open(path, 'w') as f:
-            yaml.safe_dump(data, f, sort_keys=False)
-        logger.info(f"Configuration saved to {path}")
+            yaml.dump(data, f, Dumper=_Dumper, sort_keys=False)
+        logger.info("Configuration saved to %s", path)
 
 
 class TinkerKeyFile:
     """Class for Tinker key files."""
+    _NUMBERED_SUFFIX = re.compile(r"_(\d+)\.key")
+
     def __init__(self, key_file_path: str):
         self.key_file_path = key_file_path
         self.latest_path = key_file_path
@@ -312,6 +410,10 @@ class TinkerKeyFile:
         else:
             self.keys = self._load_key_file()
             logger.info(f"Loaded key file from {self.key_file_path}.")
+        # key name -> position of its first occurrence in self.keys, kept in sync by set_key
+        self._index = {}
+        for i, k in enumerate(self.keys):
+            self._index.setdefault(k[0], i)
 
     def _load_key_file(self):
         """Load and parse the Tinker key file."""
@@ -325,47 +427,78 @@ class TinkerKeyFile:
     
     def has_key(self, key: str) -> bool:
         """Check if a parameter key exists."""
-        for k in self.keys:
-            if k[0] == key:
-                return True
-        return False
+        return key in self._index
 
     def get_key(self, key: str):
         """Get a parameter value by key."""
-        for k in self.keys:
-            if k[0] == key:
-                return k
-        return []
+        i = self._index.get(key)
+        return self.keys[i] if i is not None else []
 
     def set_key(self, key: str, value: str):
         """Set a parameter value by key."""
-        for k in self.keys:
-            if k[0] == key:
-                logger.info(f"Updating key in key file: `{key} {value}`")
-                k[1:] = value.strip().split()
-                break
+        tokens = value.split()
+        i = self._index.get(key)
+        if i is not None:
+            logger.info(f"Updating key in key file: `{key} {value}`")
+            self.keys[i][1:] = tokens
         else:
             logger.info(f"Adding new key to key file: `{key} {value}`")
-            self.keys.append([key] + value.strip().split())
+            self._index[key] = len(self.keys)
+            self.keys.append([key, *tokens])
+
+    def _render(self) -> bytes:
+        """Render the current keys as key file content."""
+        if not self.keys:
+            return b''
+        return ('\n'.join(map(' '.join, self.keys)) + '\n').encode()
+
+    @staticmethod
+    def _has_content(path: str, content: bytes) -> bool:
+        """Check if the file at `path` already holds exactly `content`."""
+        try:
+            if os.path.getsize(path) != len(content):
+                return False
+            with open(path, 'rb') as f:
+                return f.read() == content
+        except OSError:
+            return False
 
     def save_key_file(self, output_path: Optional[str] = None):
-        """Save the current keys to a key file."""
+        """Save the current keys to a key file, unless the target file already has identical content."""
+        content = self._render()
+        target = output_path or self.latest_path
+        if self._has_content(target, content):
+            logger.info(f"Key file {target} is up to date. Skipped saving.")
+            self.latest_path = target
+            return
+
         # if output_path is None, create a new file with untaken numbered suffix
         if output_path is None:
             if not os.path.exists(self.key_file_path):
                 path = self.key_file_path
             else:
                 base_path = self.key_file_path[:-4]  # remove .key
-                i = 1
-                while os.path.exists(f"{base_path}_{i}.key"):
-                    i += 1
-                path = f"{base_path}_{i}.key"
+                dir_name, prefix = os.path.split(base_path)
+                # list the directory once instead of probing `_1.key`, `_2.key`, ... one stat at a time
+                used = [0]
+                with os.scandir(dir_name or '.') as entries:
+                    for entry in entries:
+                        if entry.name.startswith(prefix):
+                            m = TinkerKeyFile._NUMBERED_SUFFIX.fullmatch(entry.name, len(prefix))
+                            if m:
+                                used.append(int(m.group(1)))
+                path = f"{base_path}_{max(used) + 1}.key"
         else:
             path = output_path
 
-        with open(path, 'w') as f:
-            for key in self.keys:
-                f.write(' '.join(key) + "\n")
+        # write the rendered bytes straight to the fd, bypassing the buffered file layer
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            view = memoryview(content)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
         logger.info(f"Key file saved to {path}")
         
         self.latest_path = path
@@ -375,53 +508,118 @@ class AtomTypeFinder:
     """Class for finding atom types from Tinker parameter files."""
     def __init__(self, prm_file_path: str):
         self.prm_file_path = prm_file_path
-        self.atom_defs = self._load_atom_definitions()
-        self.multipole_defs = self._load_multipole_definitions()
-
-    def _load_atom_definitions(self):
-        """Load and parse atom definitions from the Tinker parameter file."""
+        # parameter files are big, so they are only read again once modified
+        key = _file_cache_key(prm_file_path)
+        if key not in _PRM_CACHE:
+            _PRM_CACHE[key] = self._load_definitions()
+        self.atom_defs, self.multipole_defs = _PRM_CACHE[key]
+        # definitions are split once here instead of on every query
+        self._atom_index = []
+        for atom_def in self.atom_defs:
+            parts = atom_def.split()
+            if len(parts) >= 4:
+                # atomic_number = parts[5]
+                self._atom_index.append((parts[1], atom_def))
+        self._atom_charges = {}
+        for multipole_def in self.multipole_defs:
+            parts = multipole_def.split()
+            # a type may have several multipole records (one per local frame); None marks disagreeing charges
+            charge = self._atom_charges.setdefault(parts[1], parts[-1])
+            if charge is not None and float(charge) != float(parts[-1]):
+                self._atom_charges[parts[1]] = None
+        # lookup results are kept on the instance, so repeated queries (e.g. the same ion) are dict hits
+        self._atom_types = {}
+
+    def _load_definitions(self):
+        """Load atom and multipole definitions from the Tinker parameter file in one pass."""
         atom_defs = []
-        with open(self.prm_file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('atom'):
-                    atom_defs.append(line)
-        return atom_defs
-    
-    def _load_multipole_definitions(self):
-        """Load and parse multipole definitions from the Tinker parameter file."""
         multipole_defs = []
-        with open(self.prm_file_path, 'r') as f:
+        with open(self.prm_file_path, 'rb') as f:
             for line in f:
-                line = line.strip()
-                if line.startswith('multipole'):
-                    multipole_defs.append(line)
-        return multipole_defs
+                # prefix tests run on raw bytes, so only the few matching lines are ever decoded
+                line = line.lstrip()
+                if line.startswith(b'atom'):
+                    atom_defs.append(line.decode('utf-8', 'replace').rstrip())
+                elif line.startswith(b'multipole'):
+                    multipole_defs.append(line.decode('utf-8', 'replace').rstrip())
+        return atom_defs, multipole_defs
 
     def find_atom_type(self, description):
         """Find the atom type based on description."""
-        for atom_def in self.atom_defs:
-            parts = atom_def.split()
-            if len(parts) >= 4:
-                atom_type = parts[1]
-                # atomic_number = parts[5]
+        if description not in self._atom_types:
+            self._atom_types[description] = 0
+            for atom_type, atom_def in self._atom_index:
                 if description in atom_def:
-                    return atom_type
-        return 0
+                    self._atom_types[description] = atom_type
+                    break
+        return self._atom_types[description]
     
     def find_atom_charge(self, atom_type):
-        """Find the atom charge based on atom type."""
-        for multipole_def in self.multipole_defs:
-            parts = multipole_def.split()
-            m_type = parts[1]
-            charge = parts[-1]
-            if m_type == atom_type:
-                return float(charge)
-        return None
+        """Find the atom charge based on atom type.
+        Returns None if the type has no multipole record, or several with different charges."""
+        charge = self._atom_charges.get(atom_type)
+        if charge is None:
+            return None
+        return float(charge)
     
 
+def fast_copy(src, dst):
+    """Copy file content from `src` to `dst` (a file or directory path, like `shutil.copy`).
+    Tries in-kernel copies first (`copy_file_range`, which reflinks on CoW filesystems, then `sendfile`),
+    and falls back to a read/write loop through one reused 1 MB buffer.
+    Unlike `shutil.copy`, permission bits are not copied.
+
+    Returns:
+        str: path of the copied file
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    # opening `dst` for writing would truncate `src` if both are the same file
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        # every fallback continues from the current file offsets, so a partial copy is never repeated;
+        # some filesystems copy nothing and return 0 instead of failing, so that counts as unsupported too
+        try:
+            copied = 0
+            while n := os.copy_file_range(src_fd, dst_fd, 2 ** 30):
+                copied += n
+            if copied or not size:
+                return dst
+        except (AttributeError, OSError):
+            pass
+        try:
+            copied = 0
+            while n := os.sendfile(dst_fd, src_fd, None, 2 ** 30):
+                copied += n
+            if copied or not size:
+                return dst
+        except (AttributeError, OSError):
+            pass
+        buf = memoryview(bytearray(1 << 20))
+        while n := fsrc.readinto(buf):
+            fdst.write(buf[:n])
+    return dst
+
+
 def make_readable_ids(ids, fill_gaps_under=1):
+    """Collapse ids into runs, e.g. [1, 2, 3, 5, 7, 8] -> [[1, 3], 5, [7, 8]].
+
+    Args:
+        ids (iterable): unique integer ids, in any order
+        fill_gaps_under (int): neighboring ids at most this far apart belong to the same run
+
+    Returns:
+        list: single ids and [first, last] pairs of runs, in ascending order
+    """
     ids = sorted(ids)
+    if not ids:
+        return []
+    # common case: one contiguous block (e.g. a single solute), no need to step through it
+    if fill_gaps_under >= 1 and ids[-1] - ids[0] == len(ids) - 1:
+        return [ids[0]] if len(ids) == 1 else [[ids[0], ids[-1]]]
     readable_ids = []
     start = ids[0]
     last = ids[0]